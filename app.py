@@ -1,8 +1,14 @@
 from flask import Flask, render_template_string
 from mvg import MvgApi, MvgApiError
 from datetime import datetime
+import time
 import main
 
+REFRESH_SECONDS = 10  # page auto-refresh interval; a rendered page is reused this long
+
+_cached_html = None
+_cached_until = 0.0
+
 def get_departures_for_station(station_id, limit=5):
     try:
         mvgapi = MvgApi(station_id)
@@ -45,11 +51,18 @@ def index():
     # return render_template_string(html, departures=filtered)
 
     
+    # Every open browser reloads the page every REFRESH_SECONDS; serve them all
+    # the same rendering instead of querying the MVG API once per request
+    global _cached_html, _cached_until
+    now = time.monotonic()
+    if _cached_html is not None and now < _cached_until:
+        return _cached_html
+
     content = main.main()
     html = f"""
     <html>
     <head>
-        <meta http-equiv='refresh' content='10'>
+        <meta http-equiv='refresh' content='{REFRESH_SECONDS}'>
         <title>Departures</title>
     </head>
     <body>
@@ -57,6 +70,8 @@ def index():
     </body>
     </html>
     """
+    _cached_html = html
+    _cached_until = now + REFRESH_SECONDS
     return html
 
 if __name__ == "__main__":
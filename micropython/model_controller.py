@@ -2,6 +2,7 @@ import wifi
 import socket
 import sys
 import time
+import select
 import errno
 import machine
 from machine import Pin
@@ -13,6 +14,7 @@ from machine import PWM
 # Network
 SERVER_IP = "192.168.178.26"
 SERVER_PORT = 8080
+RX_BUF_SIZE = 256       # bytes - receive buffer, also the longest accepted command line
 
 # Watchdog timers (must coordinate with server settings)
 PING_INTERVAL = 10      # seconds - how often MCU sends PING
@@ -60,6 +62,7 @@ BRAKE_DEAD_ZONE: float = 0.13    # effective zero for braking physics; tune inde
                                  # brake_step = (v₀ - BRAKE_DEAD_ZONE)² * BRAKE_DECEL / 100
 BRAKE_DECEL: float = 0.88        # braking strength coefficient (dimensionless, server-tunable)
                                  # higher = shorter braking distance, lower = longer
+SPEED_TICK_MS: int = 10          # speed ramp period; poll() sleeps at most until the next tick
 
 is_led_on = True
 led_pin = LED_PIN
@@ -71,14 +74,34 @@ reverser = Pin(reverser_pin, Pin.OUT)
 hall_sensor = Pin(HALL_PIN, Pin.IN, Pin.PULL_UP)
 led = None
 
+# Console output is a synchronous UART write, so messages from the control
+# loop are buffered and written out when the loop is idle.
+LOG_FLUSH_BYTES = 512
+_log_buf = bytearray()
+
+def log(msg: str):
+    """Queue a log line; it is printed by flush_log()."""
+    _log_buf.extend(msg.encode())
+    _log_buf.append(0x0a)
+
+def flush_log():
+    """Write all queued log lines to the console."""
+    global _log_buf
+    if _log_buf:
+        # Swap in a fresh buffer before writing, so a line queued by a
+        # scheduled callback during the write is kept for the next flush
+        buf = _log_buf
+        _log_buf = bytearray()
+        sys.stdout.write(buf)
+
 def toggle_led():
     global is_led_on, led
     if led == None:
-        print(f"Error: led is None")
+        log(f"Error: led is None")
         return
     is_led_on = not is_led_on
     led.value(is_led_on)
-    print(f"LED is now {'ON' if is_led_on else 'OFF'}")
+    log(f"LED is now {'ON' if is_led_on else 'OFF'}")
     
 def set_speed(speed: float):
     """Set the target speed. The main loop ramps current_speed toward it linearly.
@@ -89,7 +112,12 @@ def set_speed(speed: float):
     """
     global pwm, train_started_at, current_speed, final_speed, hall_loops_remaining, hall_loop_config, braking
 
-    speed = max(0., min(speed, 1.))
+    # Conditional clamp: no global lookups or calls for min()/max().
+    # Written so NaN (every comparison false) falls into the zero branch.
+    if not speed > 0.:
+        speed = 0.
+    elif speed > 1.:
+        speed = 1.
 
     # Cancel hall-triggered braking if the server overrides the speed
     braking = False
@@ -98,13 +126,13 @@ def set_speed(speed: float):
     if current_speed == 0.0 and speed > 0.0:
         train_started_at = time.time()
         hall_loops_remaining = hall_loop_config
-        print(f"Train started at {train_started_at}, loops set to {hall_loops_remaining}")
+        log(f"Train started at {train_started_at}, loops set to {hall_loops_remaining}")
 
     final_speed = speed
-    print(f"Target speed set to {speed:.2f}")
+    log(f"Target speed set to {speed:.2f}")
     
 def set_reverser(reversed : bool):
-    print("Set reverser to", reversed)
+    log(f"Set reverser to {reversed}")
     global reverser
     reverser.value(reversed)
 
@@ -138,38 +166,76 @@ def start_socket_client():
     s = None
     last_ping_sent: float = 0.0
     waiting_for_pong: bool = False
+
+    # Hot lookups bound as locals (no global dict probes in the loop)
+    now_s = time.time
+    ticks = time.ticks_ms
+    tdiff = time.ticks_diff
+    sleep = time.sleep
+    EAGAIN = errno.EAGAIN
+    ECONNRESET = errno.ECONNRESET
+    ETIMEDOUT = errno.ETIMEDOUT
+    s_write = None
+    s_readinto = None
+    # Incoming bytes are read into one fixed buffer; rx_len bytes of it hold a
+    # partial line carried over to the next read. rx_discard drops the rest
+    # of a line that overflowed the buffer.
+    rx_buf = bytearray(RX_BUF_SIZE)
+    rx_mv = memoryview(rx_buf)
+    rx_len = 0
+    rx_discard = False
+    poll = None
+    last_tick_ms = ticks()
     
     while True:
         # Connection/reconnection loop
         if s is None:
             try:
-                print(f"Attempting to connect to {SERVER_IP}:{SERVER_PORT}...")
+                log(f"Attempting to connect to {SERVER_IP}:{SERVER_PORT}...")
+                flush_log()  # connect() below blocks for up to 5 s
                 s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
                 s.settimeout(5.0)  # 5 second timeout for connect
                 s.connect((SERVER_IP, SERVER_PORT))
+                # Let the stack probe the connection too where the port supports it.
+                # PING/PONG stays: lwIP ports don't expose the keepalive timers and
+                # the server's watchdog relies on our PINGs.
+                if hasattr(socket, "SO_KEEPALIVE"):
+                    s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                # Send short command lines (HALL, PING) without Nagle delay
+                if hasattr(socket, "TCP_NODELAY"):
+                    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
                 s.setblocking(False)  # Set non-blocking after connect
+                s_write = s.write
+                s_readinto = s.readinto
+                rx_len = 0
+                rx_discard = False
+                # Wake on incoming data instead of sleeping a fixed 10 ms
+                poller = select.poll()
+                poller.register(s, select.POLLIN)
+                poll = poller.poll
                 
-                print(f"Connected to server at {SERVER_IP}:{SERVER_PORT}")
+                log(f"Connected to server at {SERVER_IP}:{SERVER_PORT}")
                 
                 # Send HELLO handshake
-                s.write(b"HELLO:MODEL\n")
-                print("Sent HELLO:MODEL")
+                s_write(b"HELLO:MODEL\n")
+                log("Sent HELLO:MODEL")
                 
                 # Reset watchdog timers
-                last_ping_sent = time.time()
+                last_ping_sent = now_s()
                 waiting_for_pong = False
                 
             except OSError as e:
-                print(f"Connection failed: {e}")
+                log(f"Connection failed: {e}")
                 if s:
                     try:
                         s.close()
                     except:
                         pass
                     s = None
-                print(f"Retrying in {RECONNECT_DELAY} seconds...")
-                time.sleep(RECONNECT_DELAY)
+                log(f"Retrying in {RECONNECT_DELAY} seconds...")
+                flush_log()
+                sleep(RECONNECT_DELAY)
                 continue
         
         # Main communication loop
@@ -177,18 +243,18 @@ def start_socket_client():
             # Hall sensor check
             # Slow pass: pin still LOW and enough time has elapsed → confirm now.
             # Fast pass: already confirmed by rising-edge IRQ, hall_triggered is set.
-            if hall_measuring and time.ticks_diff(time.ticks_ms(), hall_fall_time) >= HALL_MIN_LOW_MS:
+            if hall_measuring and tdiff(ticks(), hall_fall_time) >= HALL_MIN_LOW_MS:
                 hall_measuring = False
                 hall_triggered = True
 
             if hall_triggered:
                 hall_triggered = False
 
-                current_time = time.time()
+                current_time = now_s()
                 time_since_start = current_time - train_started_at
 
                 if time_since_start < HALL_STARTUP_DELAY:
-                    print(f"Ignoring hall trigger during startup/cooldown (t={time_since_start:.1f}s)")
+                    log(f"Ignoring hall trigger during startup/cooldown (t={time_since_start:.1f}s)")
                 elif hall_loops_remaining < 0:
                     # Infinite mode – ignore hall sensor
                     pass
@@ -203,115 +269,130 @@ def start_socket_client():
                         # raise it if slow speeds overshoot, lower it if they stop early.
                         effective = max(0.0, current_speed - BRAKE_DEAD_ZONE)
                         brake_step = effective ** 2 * BRAKE_DECEL / 100
-                        print(f"Braking: entry={current_speed:.3f}, effective={effective:.3f}, step={brake_step:.5f}/tick")
+                        log(f"Braking: entry={current_speed:.3f}, effective={effective:.3f}, step={brake_step:.5f}/tick")
                     else:
                         # Already stopped — notify server immediately
                         try:
-                            s.write(b"HALL\n")
-                            print("Sent HALL – train already stopped")
+                            s_write(b"HALL\n")
+                            log("Sent HALL – train already stopped")
                         except OSError as e:
-                            print(f"Failed to send HALL: {e}")
+                            log(f"Failed to send HALL: {e}")
                             raise
                 else:
                     # More loops to go – apply cooldown and decrement
                     hall_loops_remaining -= 1
-                    train_started_at = time.time()
-                    print(f"Pass-through, cooldown reset, {hall_loops_remaining} loop(s) remaining")
+                    train_started_at = now_s()
+                    log(f"Pass-through, cooldown reset, {hall_loops_remaining} loop(s) remaining")
             
-            # Speed control (runs every 10 ms)
-            if braking:
-                # Hall-triggered deceleration: quadratic profile → constant stopping distance
-                current_speed -= brake_step
-                if current_speed <= TRACTION_MIN:
-                    # Motor has stalled / below traction — train is stopped
-                    current_speed = 0.0
-                    final_speed = 0.0
-                    braking = False
-                    try:
-                        s.write(b"HALL\n")
-                        print("Sent HALL – train stopped after braking")
-                    except OSError as e:
-                        print(f"Failed to send HALL: {e}")
-                        raise
-                pwm.duty_u16(int(current_speed * 65535.0) if current_speed >= TRACTION_MIN else 0)
-            else:
-                # Normal speed ramp: linear acceleration / deceleration
-                speed_diff = final_speed - current_speed
-                if speed_diff > 0:
-                    current_speed = min(final_speed, current_speed + LINEAR_ACCEL_STEP)
-                    # Jump over the stall zone when starting from rest
-                    if 0 < current_speed < TRACTION_MIN:
-                        current_speed = TRACTION_MIN
-                elif speed_diff < 0:
-                    current_speed = max(final_speed, current_speed - LINEAR_ACCEL_STEP)
-                    if current_speed < TRACTION_MIN:
+            # Speed control (runs every SPEED_TICK_MS, independent of how often
+            # poll() wakes us up for incoming data)
+            now_ms = ticks()
+            if tdiff(now_ms, last_tick_ms) >= SPEED_TICK_MS:
+                last_tick_ms = now_ms
+                if braking:
+                    # Hall-triggered deceleration: quadratic profile → constant stopping distance
+                    current_speed -= brake_step
+                    if current_speed <= TRACTION_MIN:
+                        # Motor has stalled / below traction — train is stopped
                         current_speed = 0.0
-                        final_speed = 0.0  # snap to zero — motor can't run this slow
-                pwm.duty_u16(int(current_speed * 65535.0) if current_speed >= TRACTION_MIN else 0)
+                        final_speed = 0.0
+                        braking = False
+                        try:
+                            s_write(b"HALL\n")
+                            log("Sent HALL – train stopped after braking")
+                        except OSError as e:
+                            log(f"Failed to send HALL: {e}")
+                            raise
+                    pwm.duty_u16(int(current_speed * 65535.0) if current_speed >= TRACTION_MIN else 0)
+                else:
+                    # Normal speed ramp: linear acceleration / deceleration
+                    speed_diff = final_speed - current_speed
+                    if speed_diff > 0:
+                        current_speed = min(final_speed, current_speed + LINEAR_ACCEL_STEP)
+                        # Jump over the stall zone when starting from rest
+                        if 0 < current_speed < TRACTION_MIN:
+                            current_speed = TRACTION_MIN
+                    elif speed_diff < 0:
+                        current_speed = max(final_speed, current_speed - LINEAR_ACCEL_STEP)
+                        if current_speed < TRACTION_MIN:
+                            current_speed = 0.0
+                            final_speed = 0.0  # snap to zero — motor can't run this slow
+                    pwm.duty_u16(int(current_speed * 65535.0) if current_speed >= TRACTION_MIN else 0)
             
             
             # Watchdog: Check if we need to send PING
-            current_time = time.time()
+            current_time = now_s()
             if current_time - last_ping_sent >= PING_INTERVAL:
                 try:
-                    s.write(b"PING\n")
+                    s_write(b"PING\n")
                     last_ping_sent = current_time
                     waiting_for_pong = True
-                    print("Sent PING")
+                    log("Sent PING")
                 except OSError as e:
-                    print(f"Failed to send PING: {e}")
+                    log(f"Failed to send PING: {e}")
                     raise
             
             # Watchdog: Check if we're waiting for PONG and it's overdue
             if waiting_for_pong and (current_time - last_ping_sent > PONG_TIMEOUT):
-                print(f"No PONG received within {PONG_TIMEOUT}s after PING - reconnecting")
+                log(f"No PONG received within {PONG_TIMEOUT}s after PING - reconnecting")
                 try:
                     s.close()
                 except:
                     pass
                 s = None
-                time.sleep(RECONNECT_DELAY)
+                flush_log()
+                sleep(RECONNECT_DELAY)
                 continue
             
-            # Read line (non-blocking)
-            raw_line = b""
+            # Read whatever has arrived into rx_buf (readline() would issue one
+            # recv per byte); a trailing partial line stays buffered until its
+            # newline arrives
             try:
-                raw_line = s.readline()
+                count = s_readinto(rx_mv[rx_len:])
             except OSError as e:
-                if e.args[0] != errno.EAGAIN:
+                if e.args[0] != EAGAIN:
                     raise
-                # No data available
+                count = None  # No data available
             
-            # Check if connection was closed (readline returns empty bytes)
-            if raw_line == b"":
-                # Empty read could mean closed connection, check again
+            # readinto() returns 0 only when the server closed the connection
+            if count == 0:
+                log("Server closed connection - reconnecting")
                 try:
-                    # Try another read to confirm
-                    test = s.recv(1)
-                    if test == b"":
-                        print("Server closed connection - reconnecting")
-                        try:
-                            s.close()
-                        except:
-                            pass
-                        s = None
-                        time.sleep(RECONNECT_DELAY)
-                        continue
-                except OSError as e:
-                    if e.args[0] != errno.EAGAIN:
-                        # Connection is dead
-                        print("Connection lost - reconnecting")
-                        try:
-                            s.close()
-                        except:
-                            pass
-                        s = None
-                        time.sleep(RECONNECT_DELAY)
-                        continue
+                    s.close()
+                except:
+                    pass
+                s = None
+                flush_log()
+                sleep(RECONNECT_DELAY)
+                continue
             
-            # Only process if we got data
-            if raw_line:
-                line_str = raw_line.decode('utf-8', 'ignore').strip()
+            # Scan only the new bytes for newlines (bytearray has no find())
+            # and parse each complete line straight from rx_buf; the partial
+            # line left at the end is moved to the front once
+            end = rx_len + count if count else 0
+            scan = rx_len
+            line_start = 0
+            while count:
+                nl = scan
+                while nl < end and rx_buf[nl] != 10:
+                    nl += 1
+                if nl == end:
+                    rx_len = 0 if rx_discard else end - line_start
+                    if rx_len == RX_BUF_SIZE:
+                        log("Line too long - discarding up to the next newline")
+                        rx_len = 0
+                        rx_discard = True
+                    elif rx_len and line_start:
+                        rx_mv[:rx_len] = rx_mv[line_start:end]
+                    break
+                raw_line = rx_mv[line_start:nl]
+                line_start = scan = nl + 1
+                if rx_discard:
+                    rx_discard = False  # end of the overlong line
+                    continue
+                line_str = str(raw_line, 'utf-8', 'ignore').strip()
+                if not line_str:
+                    continue
                 
                 """
                 Train Control Protocol:
@@ -324,89 +405,95 @@ def start_socket_client():
                 """
                 if line_str == "PONG":
                     waiting_for_pong = False
-                    print("Received PONG")
+                    log("Received PONG")
                 elif line_str == "LED_BUTTON":
-                    print("Received Button")
+                    log("Received Button")
                     toggle_led()
-                    s.write(b"LED toggled!\n")
+                    s_write(b"LED toggled!\n")
                 elif line_str.startswith("SPEED:"):
-                    print("Received slider")
-                    s.write(b"Slider received!\n")
+                    log("Received slider")
+                    s_write(b"Slider received!\n")
                     try:
-                        value = float(line_str.split(':')[1])
+                        value = float(line_str[6:])
                         set_speed(value)
-                        print(f"Slider value: {value}")
-                    except (IndexError, ValueError):
-                        print("Invalid slider format")
+                        log(f"Slider value: {value}")
+                    except ValueError:
+                        log("Invalid slider format")
                 elif line_str.startswith("REVERSER:"):
                     reverser_state = bool(int(line_str.split(":")[1]))
-                    print("Reverser state:", reverser_state)
+                    log(f"Reverser state: {reverser_state}")
                     set_reverser(reverser_state)
                 elif line_str.startswith("LOOPS:"):
                     try:
                         loops = int(line_str.split(":")[1])
                         hall_loop_config = loops    # negative=infinite, 0=stop immediately, N=extra loops
                         hall_loops_remaining = loops  # take effect immediately, not just on next start
-                        print(f"Hall loop count set to {hall_loop_config}")
+                        log(f"Hall loop count set to {hall_loop_config}")
                     except (IndexError, ValueError):
-                        print("Invalid LOOPS format")
+                        log("Invalid LOOPS format")
                 elif line_str.startswith("BRAKE_DECEL:"):
                     try:
                         BRAKE_DECEL = float(line_str.split(":")[1])
-                        print(f"Brake decel set to {BRAKE_DECEL}")
+                        log(f"Brake decel set to {BRAKE_DECEL}")
                     except (IndexError, ValueError):
-                        print("Invalid BRAKE_DECEL format")
+                        log("Invalid BRAKE_DECEL format")
                 elif line_str.startswith("BRAKE_DEAD_ZONE:"):
                     try:
                         BRAKE_DEAD_ZONE = float(line_str.split(":")[1])
-                        print(f"Brake dead zone set to {BRAKE_DEAD_ZONE}")
+                        log(f"Brake dead zone set to {BRAKE_DEAD_ZONE}")
                     except (IndexError, ValueError):
-                        print("Invalid BRAKE_DEAD_ZONE format")
+                        log("Invalid BRAKE_DEAD_ZONE format")
                 else:
-                    print(f"Unknown command: {line_str}")
+                    log(f"Unknown command: {line_str}")
                 # Ignore unknown messages silently (could be ACK or other server messages)
 
         except OSError as e:
             code = e.args[0]
-            if code == errno.ECONNRESET:
-                print("Connection reset/broken pipe – reconnecting")
+            if code == ECONNRESET:
+                log("Connection reset/broken pipe – reconnecting")
                 try:
                     s.close()
                 except:
                     pass
                 s = None
-                time.sleep(RECONNECT_DELAY)
+                flush_log()
+                sleep(RECONNECT_DELAY)
                 continue
-            elif code == errno.EAGAIN:
+            elif code == EAGAIN:
                 # No data this cycle — skip work
                 pass
-            elif code == errno.ETIMEDOUT:
-                print("Connection timed out - reconnecting")
+            elif code == ETIMEDOUT:
+                log("Connection timed out - reconnecting")
                 try:
                     s.close()
                 except:
                     pass
                 s = None
-                time.sleep(RECONNECT_DELAY)
+                flush_log()
+                sleep(RECONNECT_DELAY)
                 continue
             else:
-                print(f"Socket error: {e} - reconnecting")
+                log(f"Socket error: {e} - reconnecting")
                 try:
                     s.close()
                 except:
                     pass
                 s = None
-                time.sleep(RECONNECT_DELAY)
+                flush_log()
+                sleep(RECONNECT_DELAY)
                 continue
 
-        # Do other tasks here...
-        time.sleep_ms(10)
+        # Sleep until data arrives or the next speed tick is due; write out
+        # buffered log lines only when idle so the UART stays off busy paths
+        if not poll(max(1, SPEED_TICK_MS - tdiff(ticks(), last_tick_ms))) or len(_log_buf) > LOG_FLUSH_BYTES:
+            flush_log()
 
 def main():
     global led, is_led_on
     led_pwm = PWM(led_pin, freq=4, duty_u16=35555)
     set_reverser(True)
     set_speed(0.0)
+    flush_log()
     
     # Set up hall effect sensor with interrupt
     # MicroPython only supports one IRQ per pin, so we combine both edges into
@@ -452,6 +539,7 @@ def main():
         try:
             start_socket_client()
         except Exception as e:
+            flush_log()
             print(f"Fatal error in socket client: {e}")
             print("Restarting in 5 seconds...")
             time.sleep(5)
@@ -14,31 +14,65 @@ Configuration:
 3. Configure motor and HALL sensor pins
 """
 
+import os
+import sys
 import network
 import time
+import errno
 import socket
+import select
 import struct
-import hashlib
+import random
 import binascii
+import micropython
+from micropython import const
 from machine import Pin, PWM
 
+# Lets the hard HALL IRQ report an exception without allocating
+micropython.alloc_emergency_exception_buf(100)
+
 # ============================================================
 # CONFIGURATION - EDIT THESE
 # ============================================================
+# Numeric settings use const() so the compiler inlines them at each use.
 
 SERVER_IP = "192.168.1.100"  # TODO: Change to your server IP
-SERVER_PORT = 8765
+SERVER_PORT = const(8765)
 
 WIFI_SSID = "YourWiFiSSID"      # TODO: Change to your WiFi
 WIFI_PASSWORD = "YourPassword"   # TODO: Change to your WiFi password
 
 # Hardware pins (TODO: adjust for your Psoc 6 setup)
-MOTOR_PWM_PIN = 0   # PWM pin for motor speed control
-HALL_SENSOR_PIN = 1 # Digital input for HALL sensor
+MOTOR_PWM_PIN = const(0)  # PWM pin for motor speed control
+HALL_SENSOR_PIN = const(1)  # Digital input for HALL sensor
 
 # PWM settings
-PWM_FREQ = 1000  # 1kHz PWM frequency
-PWM_MAX = 65535  # 16-bit PWM resolution
+PWM_FREQ = const(1000)  # 1kHz PWM frequency
+PWM_MAX = const(65535)  # 16-bit PWM resolution
+
+# HALL sensor
+HALL_DEBOUNCE_US = const(200000)  # ignore further edges for 200 ms after a trigger
+
+# WebSocket
+WS_TX_MAX_PAYLOAD = const(125)  # largest payload sent from the preallocated TX buffer
+WS_RX_BUF_SIZE = const(2048)  # receive ring capacity (power of two, > largest frame)
+HANDSHAKE_TIMEOUT_MS = const(5000)  # max wait for the HTTP 101 response
+ACK_TIMEOUT_MS = const(5000)  # max wait for the server's ACK after HELLO:MODEL
+SEND_TIMEOUT_MS = const(1000)  # give up if the send buffer stays full this long
+WS_MASK_FRAMES = const(1)  # 0: send an all-zero mask key and copy payloads unmasked
+                           # (only for a trusted server link without proxies)
+
+# Logging: 0 = errors only, 1 = + status/HALL events, 2 = + every message and
+# duty change. A const() level lets the compiler drop disabled log() calls,
+# f-string formatting included.
+LOG_LEVEL = const(1)
+
+# Main loop
+LOOP_TIMEOUT_MS = const(50)  # max time to block in poll() before re-checking HALL
+                               # (only used if the HALL wake socket is unavailable)
+WAKE_TIMEOUT_MS = const(500)  # poll() bound with the wake socket, in case a wake-up is lost
+WAKE_PROBE_MS = const(100)  # how long init_wake_socket() waits for its probe datagram
+WAKE_ADDR = ("127.0.0.1", 40000)  # UDP loopback used by the HALL IRQ to wake poll()
 
 # ============================================================
 # GLOBALS
@@ -49,111 +83,372 @@ hall_sensor = None
 websocket_connected = False
 ws_socket = None
 hall_triggered = False
+last_hall_us = 0      # time.ticks_us() of the last accepted HALL edge
+wake_socket = None  # UDP loopback socket; one datagram per HALL trigger
+ws_tx_buf = bytearray(14 + WS_TX_MAX_PAYLOAD)  # reused for every outgoing frame
+hall_frame = b""  # prebuilt HALL frame, masked once per connection
+
+
+# ============================================================
+# LOGGING
+# ============================================================
+
+# print() is a synchronous UART write, so messages from the motor, HALL and
+# message paths are buffered and written out before the main loop waits.
+_log_buf = bytearray()
+
+
+def log(msg):
+    """Queue a log line; it is printed by flush_log()."""
+    _log_buf.extend(msg.encode())
+    _log_buf.append(0x0a)
+
+
+def flush_log():
+    """Write all queued log lines to the console."""
+    global _log_buf
+    if _log_buf:
+        # Swap in a fresh buffer before writing, so a line queued by a
+        # scheduled callback during the write is kept for the next flush
+        buf = _log_buf
+        _log_buf = bytearray()
+        sys.stdout.write(buf)
 
 
 # ============================================================
 # SIMPLE WEBSOCKET CLIENT (MicroPython compatible)
 # ============================================================
 
+# Random bytes for the handshake key and frame masks: os.urandom() is a single
+# C call; ports without it fall back to 32-bit getrandbits() words.
+if hasattr(os, "urandom"):
+    random_bytes = os.urandom
+else:
+    def random_bytes(n):
+        """Return n random bytes (n a multiple of 4)."""
+        getrandbits = random.getrandbits
+        return b"".join(struct.pack(">I", getrandbits(32)) for _ in range(n >> 2))
+
+# Constant tail of the upgrade request, encoded once at import
+WS_REQUEST_TAIL = (
+    b"Upgrade: websocket\r\n"
+    b"Connection: Upgrade\r\n"
+    b"Sec-WebSocket-Version: 13\r\n"
+    b"\r\n"
+)
+
+
 def websocket_handshake(sock, host, path):
-    """Perform WebSocket handshake."""
-    key = binascii.b2a_base64(struct.pack("I", int(time.time())))[:-1].decode()
+    """Perform WebSocket handshake. sock must be non-blocking.
+
+    The response is read straight into ws_rx; frame bytes that arrive
+    together with the headers stay there for websocket_recv().
+    """
+    # 16 random bytes (RFC 6455), base64 without the trailing newline
+    key = binascii.b2a_base64(random_bytes(16))[:-1]
     
-    handshake = (
-        f"GET {path} HTTP/1.1\r\n"
-        f"Host: {host}\r\n"
-        f"Upgrade: websocket\r\n"
-        f"Connection: Upgrade\r\n"
-        f"Sec-WebSocket-Key: {key}\r\n"
-        f"Sec-WebSocket-Version: 13\r\n"
-        f"\r\n"
-    )
+    handshake = b"".join((
+        b"GET ", path.encode(), b" HTTP/1.1\r\n",
+        b"Host: ", host.encode(), b"\r\n",
+        b"Sec-WebSocket-Key: ", key, b"\r\n",
+        WS_REQUEST_TAIL,
+    ))
     
-    sock.send(handshake.encode())
+    send_all(sock, handshake)
     
-    # Read response
-    response = b""
-    while b"\r\n\r\n" not in response:
-        response += sock.recv(1024)
+    # Read the response into the (empty) ring until the blank line; each
+    # byte is searched for the terminator at most once
+    ws_rx.clear()
+    poller = select.poll()
+    poller.register(sock, select.POLLIN)
+    scanned = 0
+    while True:
+        if not poller.poll(HANDSHAKE_TIMEOUT_MS):
+            raise Exception("Timed out waiting for WebSocket handshake")
+        count = ws_rx.fill_from(sock)
+        if count == 0:
+            raise Exception("Connection closed during WebSocket handshake")
+        if count is None:
+            continue
+        response = bytes(ws_rx.peek(ws_rx.n))
+        end = response.find(b"\r\n\r\n", scanned)
+        if end >= 0:
+            break
+        scanned = max(0, len(response) - 3)
     
-    # Check for 101 Switching Protocols
-    if b"101" not in response:
+    # Check for 101 Switching Protocols in the status line only
+    if not response.startswith(b"HTTP/1.1 101"):
         raise Exception("WebSocket handshake failed")
     
+    # Drop the headers; any frame bytes after them stay buffered
+    ws_rx.skip(end + 4)
+    
     return True
 
 
-def websocket_send(sock, message):
-    """Send WebSocket text frame."""
-    payload = message.encode()
+@micropython.viper
+def _xor_mask(dst: ptr8, offset: int, src: ptr8, mask: ptr8, n: int):
+    """Native XOR loop: dst[offset + i] = src[i] ^ mask[i & 3].
+
+    Works on 32-bit words (the mask is loaded once as a uint32, so byte
+    order doesn't matter), then masks the 0-3 byte tail per byte. The word
+    pointers may be unaligned, which the PSoC 6's Cortex-M4 handles in
+    hardware for single loads/stores.
+    """
+    words = n >> 2
+    dst32 = ptr32(uint(dst) + uint(offset))
+    src32 = ptr32(src)
+    mask32 = ptr32(mask)[0]
+    for i in range(words):
+        dst32[i] = src32[i] ^ mask32
+    for i in range(words << 2, n):
+        dst[offset + i] = src[i] ^ mask[i & 3]
+
+
+def websocket_mask_into(out, offset, data, mask_key):
+    """XOR data with the 4-byte WebSocket mask_key (RFC 6455 section 5.3),
+    writing the result into out[offset:offset + len(data)].
+
+    The loop runs in the viper kernel _xor_mask, compiled to machine code
+    (no per-byte object boxing or bytecode dispatch).
+    """
+    _xor_mask(out, offset, data, mask_key, len(data))
+
+
+# Frame header layouts: FIN/opcode, mask bit + length code, [extended length], mask key
+WS_HDR_SHORT = ">BB4s"
+WS_HDR_MEDIUM = ">BBH4s"
+WS_HDR_LONG = ">BBQ4s"
+WS_ZERO_MASK = b"\x00\x00\x00\x00"
+
+
+def websocket_frame(payload):
+    """Build a masked WebSocket text frame for payload (bytes).
+
+    The frame is assembled in the preallocated ws_tx_buf (header, mask key
+    and masked payload); only payloads larger than WS_TX_MAX_PAYLOAD need a
+    temporary buffer. Returns a memoryview of the frame, valid until the
+    next call.
+    """
     length = len(payload)
+    frame = ws_tx_buf if length <= WS_TX_MAX_PAYLOAD else bytearray(14 + length)
     
-    # Frame format: FIN=1, opcode=1 (text), mask=1
-    frame = bytearray([0x81])  # FIN + text opcode
+    # Masking key (4 random bytes, or zeros when masking is disabled)
+    mask_key = random_bytes(4) if WS_MASK_FRAMES else WS_ZERO_MASK
     
+    # Frame format: FIN=1, opcode=1 (text), mask=1; header + mask key in one pack
     if length < 126:
-        frame.append(0x80 | length)  # Mask bit + length
+        struct.pack_into(WS_HDR_SHORT, frame, 0, 0x81, 0x80 | length, mask_key)
+        pos = 6
     elif length < 65536:
-        frame.append(0x80 | 126)
-        frame.extend(struct.pack(">H", length))
+        struct.pack_into(WS_HDR_MEDIUM, frame, 0, 0x81, 0x80 | 126, length, mask_key)
+        pos = 8
     else:
-        frame.append(0x80 | 127)
-        frame.extend(struct.pack(">Q", length))
-    
-    # Masking key (4 random bytes)
-    mask_key = struct.pack("I", int(time.ticks_ms()))
-    frame.extend(mask_key)
+        struct.pack_into(WS_HDR_LONG, frame, 0, 0x81, 0x80 | 127, length, mask_key)
+        pos = 14
     
-    # Masked payload
-    masked = bytearray(length)
-    for i in range(length):
-        masked[i] = payload[i] ^ mask_key[i % 4]
-    frame.extend(masked)
+    # Masked payload (XOR with a zero key is a plain copy)
+    if WS_MASK_FRAMES:
+        websocket_mask_into(frame, pos, payload, mask_key)
+    else:
+        frame[pos:pos + length] = payload
     
-    sock.send(frame)
+    return memoryview(frame)[:pos + length]
 
 
-def websocket_recv(sock):
-    """Receive WebSocket frame (simplified, text frames only)."""
-    try:
-        # Read first 2 bytes
-        header = sock.recv(2)
-        if len(header) < 2:
+def send_all(sock, data):
+    """Send all of data on a non-blocking socket.
+
+    send() may write only part of a frame (or raise EAGAIN) when the TCP
+    send buffer is full; keep sending the rest, waiting in poll() for
+    POLLOUT in between. Raises OSError(ETIMEDOUT) if no space frees up.
+    """
+    mv = memoryview(data)
+    total = len(mv)
+    sent = 0
+    poller = None
+    while sent < total:
+        try:
+            n = sock.send(mv[sent:])
+        except OSError as e:
+            if e.args[0] != errno.EAGAIN:
+                raise
+            n = 0
+        if n:
+            sent += n
+            continue
+        if poller is None:
+            poller = select.poll()
+            poller.register(sock, select.POLLOUT)
+        if not poller.poll(SEND_TIMEOUT_MS):
+            raise OSError(errno.ETIMEDOUT)
+
+
+def websocket_send(sock, message):
+    """Send WebSocket text frame."""
+    send_all(sock, websocket_frame(message.encode()))
+
+
+class WsRingBuffer:
+    """Fixed-size receive ring for incoming WebSocket frames.
+
+    The capacity is a power of two so wrap-around is a bitwise AND, and
+    consuming a frame only advances the read index — nothing is shifted
+    and nothing is reallocated while streaming.
+    """
+
+    def __init__(self, size):
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.wrap = size - 1
+        self.r = 0  # read index
+        self.n = 0  # bytes buffered
+
+    def clear(self):
+        self.r = 0
+        self.n = 0
+
+    def fill_from(self, sock):
+        """Read from a non-blocking sock straight into the free space at the
+        ring tail (no intermediate bytes object).
+
+        Returns the number of bytes read, 0 if the peer closed the connection,
+        or None if no data was available. Data that would wrap around is
+        picked up by the next call.
+        """
+        size = len(self.buf)
+        free = size - self.n
+        if not free:
+            raise ValueError("WebSocket receive buffer full")
+        start = (self.r + self.n) & self.wrap
+        count = sock.readinto(self.mv[start:min(size, start + free)])
+        if count:
+            self.n += count
+        return count
+
+    def peek(self, count):
+        """Return the next count buffered bytes without consuming them."""
+        return self._read(0, count)
+
+    def skip(self, count):
+        """Consume count buffered bytes."""
+        self.r = (self.r + count) & self.wrap
+        self.n -= count
+
+    def _byte(self, k):
+        return self.buf[(self.r + k) & self.wrap]
+
+    def _read(self, k, count):
+        """Return count bytes starting k bytes after the read index.
+
+        Contiguous data is returned as a memoryview into the ring, valid
+        until the bytes are overwritten by a later fill_from(); data that
+        wraps around is assembled into a new bytearray.
+        """
+        start = (self.r + k) & self.wrap
+        end = start + count
+        if end <= len(self.buf):
+            return self.mv[start:end]
+        first = len(self.buf) - start
+        out = bytearray(count)
+        out[:first] = self.mv[start:]
+        out[first:] = self.mv[:count - first]
+        return out
+
+    def pop_frame(self):
+        """Remove and return (opcode, payload) of the next complete frame,
+        or None if no complete frame is buffered yet.
+
+        payload is a bytes-like object that may view the ring itself; copy
+        it before the next fill_from(). Masked frames are rejected with
+        ValueError (RFC 6455 section 5.1: a server must not mask).
+        """
+        n = self.n
+        if n < 2:
             return None
-        
-        opcode = header[0] & 0x0F
-        masked = (header[1] & 0x80) != 0
-        length = header[1] & 0x7F
+        b1 = self._byte(1)
+        length = b1 & 0x7F
+        pos = 2
         
         # Handle extended length
         if length == 126:
-            length = struct.unpack(">H", sock.recv(2))[0]
+            if n < 4:
+                return None
+            length = (self._byte(2) << 8) | self._byte(3)
+            pos = 4
         elif length == 127:
-            length = struct.unpack(">Q", sock.recv(8))[0]
-        
-        # Read mask key if present (server shouldn't mask, but check)
-        if masked:
-            mask_key = sock.recv(4)
+            if n < 10:
+                return None
+            length = struct.unpack_from(">Q", self._read(2, 8))[0]
+            pos = 10
         
-        # Read payload
-        payload = sock.recv(length)
+        # The client must fail the connection on a masked server frame
+        if b1 & 0x80:
+            raise ValueError("Masked frame from server")
+        if n < pos + length:
+            return None
         
-        # Unmask if needed
-        if masked:
-            unmasked = bytearray(length)
-            for i in range(length):
-                unmasked[i] = payload[i] ^ mask_key[i % 4]
-            payload = unmasked
+        payload = self._read(pos, length)
+        opcode = self._byte(0) & 0x0F
+        self.skip(pos + length)
+        return opcode, payload
+
+
+ws_rx = WsRingBuffer(WS_RX_BUF_SIZE)  # reused across connections
+
+
+def websocket_pop_message():
+    """Pop the next message from ws_rx.
+
+    Returns the payload of a text frame as bytes with the trailing newline
+    stripped (not decoded; callers compare against byte literals), None for
+    a close frame, or False if no complete frame is buffered. Other frame
+    types are skipped.
+    """
+    while True:
+        frame = ws_rx.pop_frame()
+        if frame is None:
+            return False
+        opcode, payload = frame
         
         # Close frame
         if opcode == 8:
             return None
         
-        # Text frame
+        # Text frame: server messages end in "\n" (e.g. "ACK\n", "STOP\n").
+        # Trim it on the view, then copy out of the ring once.
         if opcode == 1:
-            return payload.decode()
-        
-        return None
+            end = len(payload)
+            while end and payload[end - 1] in (0x0a, 0x0d):
+                end -= 1
+            return bytes(memoryview(payload)[:end])
+
+
+def websocket_recv(sock, timeout_ms):
+    """Receive the next WebSocket text message (bytes), waiting at most timeout_ms.
+
+    Blocks in poll() until data arrives or the deadline passes; returns None
+    on timeout, close or error. sock must be non-blocking.
+    """
+    try:
+        poller = select.poll()
+        poller.register(sock, select.POLLIN)
+        poll = poller.poll
+        fill = ws_rx.fill_from
+        pop_message = websocket_pop_message
+        ticks_ms = time.ticks_ms
+        ticks_diff = time.ticks_diff
+        deadline = time.ticks_add(ticks_ms(), timeout_ms)
+        while True:
+            message = pop_message()
+            if message is not False:
+                return message
+            remaining = ticks_diff(deadline, ticks_ms())
+            if remaining <= 0 or not poll(remaining):
+                print("⏱️  Timed out waiting for WebSocket message")
+                return None
+            if fill(sock) == 0:
+                return None
         
     except Exception as e:
         print(f"Error receiving: {e}")
@@ -173,13 +468,30 @@ def init_motor():
     print("✅ Motor initialized")
 
 
-def set_speed(speed):
-    """Set motor speed (0.0 to 1.0)."""
+@micropython.viper
+def _write_duty(duty: int):
+    """Write duty to the motor PWM (native code).
+
+    Viper truncates an int argument to a machine word, so the caller must
+    range-check duty first.
+    """
+    motor_pwm.duty_u16(duty)
+
+
+def set_duty(duty):
+    """Set motor PWM duty cycle; raises ValueError outside 0..PWM_MAX."""
     global motor_pwm
+    if not 0 <= duty <= PWM_MAX:
+        raise ValueError("duty out of range")
     if motor_pwm:
-        duty = int(speed * PWM_MAX)
-        motor_pwm.duty_u16(duty)
-        print(f"🚂 Speed set to {speed:.2f} (duty={duty})")
+        _write_duty(duty)
+        if LOG_LEVEL >= 2:
+            log(f"🚂 Duty set to {duty}")
+
+
+def set_speed(speed):
+    """Set motor speed (0.0 to 1.0)."""
+    set_duty(int(speed * PWM_MAX))
 
 
 def stop_motor():
@@ -187,26 +499,82 @@ def stop_motor():
     global motor_pwm
     if motor_pwm:
         motor_pwm.duty_u16(0)
-        print("🛑 Motor stopped")
+        log("🛑 Motor stopped")
 
 
 # ============================================================
 # HALL SENSOR
 # ============================================================
 
+def _hall_event(_):
+    """Deferred part of the HALL interrupt (runs via micropython.schedule).
+
+    Does the work a hard IRQ must not do because it allocates: logging and
+    waking the main loop's poll().
+    """
+    if LOG_LEVEL >= 1:
+        log("🛑 Motor stopped")
+        log("🧲 HALL sensor triggered!")
+    if wake_socket:
+        try:
+            wake_socket.sendto(b"H", WAKE_ADDR)
+        except OSError:
+            pass  # main loop sees hall_triggered within WAKE_TIMEOUT_MS
+
+
+@micropython.viper
 def hall_interrupt(pin):
-    """HALL sensor interrupt handler."""
-    global hall_triggered
+    """HALL sensor interrupt handler.
+
+    Runs as a hard IRQ compiled to native code, so it must not allocate:
+    it only debounces, sets the flag and stops the motor, then schedules
+    _hall_event() for the rest.
+    """
+    global hall_triggered, last_hall_us
+    now = time.ticks_us()
+    elapsed = int(time.ticks_diff(now, last_hall_us))
+    if elapsed >= 0 and elapsed < HALL_DEBOUNCE_US:
+        return  # bounce (a negative diff means the last edge is too old to compare)
+    last_hall_us = now
     hall_triggered = True
-    stop_motor()  # Safety: stop immediately
-    print("🧲 HALL sensor triggered!")
+    motor_pwm.duty_u16(0)  # Safety: stop immediately
+    try:
+        micropython.schedule(_hall_event, None)
+    except RuntimeError:
+        pass  # schedule queue full – a wake-up is already pending
+
+
+def init_wake_socket():
+    """Create the UDP loopback socket the HALL handler uses to wake poll().
+
+    Sends a probe datagram to itself first: if loopback delivery does not
+    work on this port, the main loop falls back to LOOP_TIMEOUT_MS polling.
+    """
+    global wake_socket
+    sock = None
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(WAKE_ADDR)
+        sock.setblocking(False)
+        sock.sendto(b"P", WAKE_ADDR)
+        probe = select.poll()
+        probe.register(sock, select.POLLIN)
+        if not probe.poll(WAKE_PROBE_MS) or not sock.recv(16):
+            raise OSError("loopback probe not received")
+        wake_socket = sock
+        print("✅ HALL wake socket initialized")
+    except OSError as e:
+        if sock:
+            sock.close()
+        wake_socket = None
+        print(f"⚠️  No HALL wake socket ({e}), polling every {LOOP_TIMEOUT_MS} ms")
 
 
 def init_hall_sensor():
     """Initialize HALL sensor with interrupt."""
     global hall_sensor
     hall_sensor = Pin(HALL_SENSOR_PIN, Pin.IN, Pin.PULL_UP)
-    hall_sensor.irq(trigger=Pin.IRQ_FALLING, handler=hall_interrupt)
+    hall_sensor.irq(trigger=Pin.IRQ_FALLING, handler=hall_interrupt, hard=True)
     print("✅ HALL sensor initialized")
 
 
@@ -245,16 +613,25 @@ def connect_wifi():
 
 def connect_to_server():
     """Connect to server WebSocket."""
-    global ws_socket, websocket_connected
+    global ws_socket, websocket_connected, hall_frame
     
     try:
         # Create socket
         addr = socket.getaddrinfo(SERVER_IP, SERVER_PORT)[0][-1]
         ws_socket = socket.socket()
         ws_socket.connect(addr)
+        # Small control messages (HALL) should go out immediately, not wait
+        # for Nagle coalescing; lwIP ports may not expose the option
+        if hasattr(socket, "TCP_NODELAY"):
+            ws_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         
         print(f"🔌 Connected to {SERVER_IP}:{SERVER_PORT}")
         
+        # Non-blocking from here on: reads go through poll() + readinto(),
+        # which then returns what is available instead of waiting for the
+        # whole ring segment to fill
+        ws_socket.setblocking(False)
+        
         # WebSocket handshake
         websocket_handshake(ws_socket, SERVER_IP, "/")
         print("✅ WebSocket handshake complete")
@@ -263,9 +640,13 @@ def connect_to_server():
         websocket_send(ws_socket, "HELLO:MODEL")
         print("→ Sent: HELLO:MODEL")
         
+        # HALL is the only message sent from the main loop; build its frame
+        # once per connection instead of masking it on every trigger.
+        hall_frame = bytes(websocket_frame(b"HALL"))
+        
         # Wait for ACK
-        response = websocket_recv(ws_socket)
-        if response == "ACK":
+        response = websocket_recv(ws_socket, ACK_TIMEOUT_MS)
+        if response == b"ACK":
             print("← Received: ACK")
             websocket_connected = True
             return True
@@ -278,55 +659,110 @@ def connect_to_server():
         return False
 
 
+def handle_speed(value):
+    """SPEED:<x> — float speed in [0, 1]."""
+    try:
+        set_speed(float(value))
+    except (ValueError, OverflowError):
+        # Not a number, inf/nan, or a speed outside [0, 1]
+        print(f"❌ Invalid SPEED value: {value.decode()}")
+
+
+def handle_stop(_):
+    """STOP — stop the motor immediately."""
+    stop_motor()
+
+
+# Command name -> handler(value); one dict lookup instead of an if/elif chain
+COMMAND_HANDLERS = {
+    b"SPEED": handle_speed,
+    b"STOP": handle_stop,
+}
+
+
 def handle_message(message):
-    """Handle incoming message from server."""
-    if message.startswith("SPEED:"):
-        try:
-            speed = float(message.split(":")[1])
-            set_speed(speed)
-        except:
-            print(f"❌ Invalid SPEED command: {message}")
-    
-    elif message == "STOP":
-        stop_motor()
-    
+    """Handle incoming message (bytes) from server: <name>[:<value>]."""
+    name, _, value = message.partition(b":")
+    handler = COMMAND_HANDLERS.get(name)
+    if handler:
+        handler(value)
     else:
-        print(f"⚠️  Unknown command: {message}")
+        print(f"⚠️  Unknown command: {message.decode()}")
 
 
 def main_loop():
     """Main event loop."""
     global hall_triggered, websocket_connected, ws_socket
     
+    # Sleep in poll() until the server sends data or the HALL IRQ writes to
+    # the wake socket. The timeout stays finite so a lost wake-up only delays
+    # the HALL message; without a wake socket, poll at LOOP_TIMEOUT_MS.
+    poller = select.poll()
+    poller.register(ws_socket, select.POLLIN)
+    if wake_socket:
+        poller.register(wake_socket, select.POLLIN)
+        timeout_ms = WAKE_TIMEOUT_MS
+    else:
+        timeout_ms = LOOP_TIMEOUT_MS
+    
+    poll = poller.poll
+    fill = ws_rx.fill_from
+    pop_message = websocket_pop_message
+    POLLIN = select.POLLIN
+    POLLHUP_ERR = select.POLLHUP | select.POLLERR
+    
     while True:
         try:
-            # Check for incoming messages (non-blocking)
-            ws_socket.setblocking(False)
-            try:
-                message = websocket_recv(ws_socket)
-                if message:
-                    print(f"← Received: {message}")
-                    handle_message(message)
-                elif message is None:
-                    # Connection closed
-                    print("⚠️  Connection closed by server")
-                    websocket_connected = False
-                    break
-            except OSError:
-                # No data available (non-blocking)
-                pass
-            finally:
-                ws_socket.setblocking(True)
+            # Write out the log lines queued by the last pass, then wait for
+            # incoming messages or a HALL wake-up
+            flush_log()
+            closed = False
+            for entry in poll(timeout_ms):
+                ev = entry[1]
+                if entry[0] is wake_socket:
+                    # Drain wake-up datagrams; hall_triggered is handled below
+                    try:
+                        while wake_socket.recv(16):
+                            pass
+                    except OSError:
+                        pass
+                elif ev & POLLHUP_ERR:
+                    closed = True
+                elif ev & POLLIN:
+                    # Drain everything the socket has buffered (until readinto()
+                    # reports EAGAIN) before going back to poll()
+                    while not closed:
+                        count = fill(ws_socket)
+                        if count is None:
+                            break
+                        if count == 0:
+                            closed = True
+                            break
+                        message = pop_message()
+                        while message is not False:
+                            if message is None:
+                                closed = True
+                                break
+                            if message:
+                                if LOG_LEVEL >= 2:
+                                    log(f"← Received: {message.decode()}")
+                                handle_message(message)
+                            message = pop_message()
+            if closed:
+                flush_log()
+                print("⚠️  Connection closed by server")
+                websocket_connected = False
+                break
             
             # Check if HALL sensor was triggered
             if hall_triggered:
                 hall_triggered = False
-                websocket_send(ws_socket, "HALL")
-                print("→ Sent: HALL")
-            
-            time.sleep(0.05)  # 50ms loop
+                send_all(ws_socket, hall_frame)
+                if LOG_LEVEL >= 2:
+                    log("→ Sent: HALL")
             
         except Exception as e:
+            flush_log()
             print(f"❌ Error in main loop: {e}")
             websocket_connected = False
             break
@@ -350,6 +786,7 @@ def main():
     if not connect_wifi():
         print("❌ Cannot proceed without WiFi")
         return
+    init_wake_socket()
     
     # Connect to server
     while True:
@@ -358,6 +795,7 @@ def main():
             main_loop()
         
         # Reconnect after 5 seconds
+        flush_log()
         print("\n⏳ Reconnecting in 5 seconds...")
         time.sleep(5)
 
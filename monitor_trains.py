@@ -1,13 +1,55 @@
 import asyncio
 import json
+import time
 import websockets
 from pyproj import Transformer
 from datetime import datetime
 
+# orjson is faster on the large bbox messages; its JSONDecodeError
+# subclasses json's
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
 WS_URL = "wss://api.geops.io/realtime-ws/v1/?key=5cc87b12d7c5370001c1d655112ec5c21e0f441792cfc2fafe3e7a1e"
 
 transformer = Transformer.from_crs("EPSG:3857", "EPSG:4326", always_xy=True)
 
+# New trains are converted to lat/lon in batches: one transform() call over
+# lists of coordinates instead of one PROJ call per train. A batch is printed
+# when it is full or once it has been open for FLUSH_INTERVAL seconds.
+TRANSFORM_BATCH = 20
+FLUSH_INTERVAL = 0.25
+
+
+def print_new_trains(pending):
+    """Convert and print a batch of newly seen trains, then clear the batch."""
+    if not pending:
+        return
+    xs = [train['coords'][0] for train in pending]
+    ys = [train['coords'][1] for train in pending]
+    lons, lats = transformer.transform(xs, ys)
+    
+    for train, lon, lat in zip(pending, lons, lats):
+        props = train['properties']
+        print(f"🚆 Train {train['train_number']} ({train['line']})")
+        print(f"   ID: {train['train_id']}")
+        print(f"   Position: {lat:.6f}°N, {lon:.6f}°E")
+        print(f"   Map: https://www.google.com/maps?q={lat},{lon}")
+        
+        # Show interesting properties
+        if 'speed' in props:
+            print(f"   Speed: {props['speed']} km/h")
+        if 'delay' in props:
+            print(f"   Delay: {props['delay']} seconds")
+        if 'state' in props:
+            print(f"   State: {props['state']}")
+        
+        print()
+    pending.clear()
+
+
 async def monitor_all_trains():
     async with websockets.connect(WS_URL, max_size=10 * 1024 * 1024) as ws:
         print(f"🚂 Monitoring ALL S-Bahn trains with live positions")
@@ -23,14 +65,16 @@ async def monitor_all_trains():
         print(f"\nWaiting for live train positions (15 seconds)...\n")
         
         trains_seen = {}
+        pending = []  # new trains not yet converted/printed
         message_count = 0
+        batch_started = time.monotonic()
         
         try:
             async with asyncio.timeout(15):
                 async for msg in ws:
                     if isinstance(msg, str):
                         try:
-                            data = json.loads(msg)
+                            data = json_loads(msg)
                             source = data.get('source', '')
                             
                             if source.startswith('bbox_'):
@@ -49,38 +93,34 @@ async def monitor_all_trains():
                                     
                                     if train_id not in trains_seen and geom.get('type') == 'Point':
                                         trains_seen[train_id] = {
+                                            'train_id': train_id,
                                             'train_number': train_number,
                                             'line': line_name,
                                             'coords': coords,
                                             'properties': props
                                         }
                                         
-                                        # Convert to lat/lon
+                                        # Queue for lat/lon conversion
                                         if len(coords) >= 2:
-                                            lon, lat = transformer.transform(coords[0], coords[1])
-                                            
-                                            print(f"🚆 Train {train_number} ({line_name})")
-                                            print(f"   ID: {train_id}")
-                                            print(f"   Position: {lat:.6f}°N, {lon:.6f}°E")
-                                            print(f"   Map: https://www.google.com/maps?q={lat},{lon}")
-                                            
-                                            # Show interesting properties
-                                            if 'speed' in props:
-                                                print(f"   Speed: {props['speed']} km/h")
-                                            if 'delay' in props:
-                                                print(f"   Delay: {props['delay']} seconds")
-                                            if 'state' in props:
-                                                print(f"   State: {props['state']}")
-                                            
-                                            print()
+                                            pending.append(trains_seen[train_id])
+                                            if len(pending) >= TRANSFORM_BATCH:
+                                                print_new_trains(pending)
                                     
                                     if message_count % 50 == 0:
+                                        print_new_trains(pending)
                                         print(f"   [{message_count} messages received, {len(trains_seen)} unique trains]")
                                         
                         except json.JSONDecodeError:
                             pass
+                    
+                    now = time.monotonic()
+                    if not pending:
+                        batch_started = now
+                    elif now - batch_started >= FLUSH_INTERVAL:
+                        print_new_trains(pending)
         except asyncio.TimeoutError:
             pass
+        print_new_trains(pending)
         
         print("\n" + "="*80)
         print(f"📊 Summary:")
@@ -18,13 +18,27 @@ Usage:
 """
 
 import asyncio
+import bisect
+import functools
 import json
+import re
 import sys
 import time
 import traceback
-from datetime import datetime
 import websockets
 
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+# uvloop (libuv) runs the event loop's socket I/O faster than the default
+# selector loop; fall back to asyncio.run when it isn't installed
+try:
+    from uvloop import run as run_event_loop
+except ImportError:
+    run_event_loop = asyncio.run
+
 from train_state_machine import TrainStateMachine, State
 from outputs import PrintModelOutput, PrintStationOutput
 from tcp_model_output import TcpModelOutput, tcp_model_server
@@ -34,9 +48,35 @@ WS_URL = "wss://api.geops.io/realtime-ws/v1/?key=5cc87b12d7c5370001c1d655112ec5c
 
 # Destinations we're looking for
 TARGET_DESTINATIONS = ["Mammendorf", "Maisach"]
+# One compiled alternation scans a destination once for all targets
+TARGET_RE = re.compile("|".join(map(re.escape, TARGET_DESTINATIONS)))
 PING_TIMEOUT = 10  # seconds - if no PING received from geops.io, consider connection dead
 
 
+_clock_sec: int = -1
+_clock_str: str = ""
+
+
+def clock_str() -> str:
+    """Current local time as HH:MM:SS, formatted at most once per second."""
+    global _clock_sec, _clock_str
+    sec = int(time.time())
+    if sec != _clock_sec:
+        _clock_sec = sec
+        _clock_str = time.strftime("%H:%M:%S", time.localtime(sec))
+    return _clock_str
+
+
+@functools.lru_cache(maxsize=256)
+def _minute_str(minute: int) -> str:
+    return time.strftime("%H:%M", time.localtime(minute * 60))
+
+
+def format_time_ms(timestamp_ms: float) -> str:
+    """Format a millisecond Unix timestamp as local HH:MM (cached per minute)."""
+    return _minute_str(int(timestamp_ms // 60000))
+
+
 def load_stations(path: str = "travel_times.json") -> list:
     """Load station list from travel_times.json."""
     with open(path) as f:
@@ -52,7 +92,7 @@ async def get_station_uic(ws, station_name: str) -> str | None:
     try:
         async with asyncio.timeout(5):
             async for msg in ws:
-                data = json.loads(msg)
+                data = json_loads(msg)
                 if data.get("source") == "station":
                     content = data.get("content", {})
                     props = content.get("properties", {})
@@ -74,14 +114,14 @@ async def get_incoming_trains(ws, uic: str, max_trains: int = 100) -> list:
     try:
         async with asyncio.timeout(5):
             async for msg in ws:
-                data = json.loads(msg)
+                data = json_loads(msg)
                 if data.get("source", "").startswith("timetable_"):
                     content = data.get("content", {})
                     train_number = content.get("train_number")
                     destination = (content.get("to") or ["Unknown"])[0]
                     aimed_ms = content.get("aimedDepartureTime") or content.get("time", 0)
                     estimated_ms = content.get("departureTime") or aimed_ms
-                    time_str = datetime.fromtimestamp(aimed_ms / 1000).strftime("%H:%M")
+                    time_str = format_time_ms(aimed_ms)
                     state = content.get("state")
 
                     # Filter out trains that are clearly not running (CANCELLED state if it exists)
@@ -101,10 +141,14 @@ async def get_incoming_trains(ws, uic: str, max_trains: int = 100) -> list:
                         break
     except asyncio.TimeoutError:
         pass
-    trains.sort(key=lambda t: t["timestamp"])
+    trains.sort(key=_timestamp)
     return trains
 
 
+def _timestamp(train: dict) -> int:
+    return train["timestamp"]
+
+
 def pick_target_train(trains: list, exclude_before_ms: float = 0) -> int | None:
     """Pick first train going to one of our target destinations in the next 30 minutes.
     
@@ -115,24 +159,22 @@ def pick_target_train(trains: list, exclude_before_ms: float = 0) -> int | None:
                           timetable entries for already-passed trains are ignored,
                           even if they still appear as 'upcoming' in the API.
     """
-    import time
-    now_ms = time.time() * 1000
+    now_ms = time.time_ns() // 1_000_000
     max_future_ms = now_ms + (30 * 60 * 1000)  # 30 minutes from now
 
-    for t in trains:
-        dest = t.get("destination", "")
-        timestamp = t.get("timestamp", 0)
-        number = t.get("number")
-
-        # Skip trains at or before the last tracked train's scheduled slot
-        if timestamp <= exclude_before_ms:
-            continue
+    # trains is sorted by timestamp: jump straight to the first train that is
+    # both after the last tracked slot and not yet departed, then scan only
+    # the 30-minute window
+    first = max(bisect.bisect_right(trains, exclude_before_ms, key=_timestamp),
+                bisect.bisect_left(trains, now_ms, key=_timestamp))
 
-        # Only consider trains departing in the next 30 minutes
-        if timestamp < now_ms or timestamp > max_future_ms:
-            continue
+    for t in trains[first:]:
+        if t["timestamp"] > max_future_ms:
+            break
 
-        if any(d in dest for d in TARGET_DESTINATIONS):
+        dest = t.get("destination", "")
+        if TARGET_RE.search(dest):
+            number = t.get("number")
             print(f"🎯 Selected: Train {number} → {dest} @ {t['time']}")
             return number
     return None
@@ -179,9 +221,15 @@ async def track_with_state_machine(ws, train_number: int, sm: TrainStateMachine,
     # (since the SM starts in WAITING_AT_NONAME), burning through all trains.
     departed = False
     last_train_msg: float = time.time()  # wall-clock of last message FOR our train
+    traced_errors: set = set()  # (type, message) of errors already printed with a traceback
 
     sm.restart_event.clear()
 
+    # Most BBOX messages only carry other trains. Any message about ours
+    # contains its "train_number" key, so searching the raw text for it skips
+    # parsing the rest (the bare digits also occur in timestamps/coordinates).
+    train_number_re = re.compile(rf'"train_number"\s*:\s*{train_number}\b')
+
     async for message in ws:
         # Check for manual restart request from station display
         if sm.restart_event.is_set():
@@ -195,31 +243,34 @@ async def track_with_state_machine(ws, train_number: int, sm: TrainStateMachine,
             return False
 
         try:
-            data = json.loads(message)
-            source = data.get("source", "")
-            content = data.get("content")
-
-            if source == "buffer":
-                # Buffer contains a batch of updates
-                for item in content or []:
-                    if not item:
-                        continue
-                    trajectory = item.get("content")
-                    if _is_our_train(trajectory, train_number):
+            if train_number_re.search(message):
+                data = json_loads(message)
+                source = data.get("source", "")
+                content = data.get("content")
+
+                if source == "buffer":
+                    # Buffer contains a batch of updates
+                    for item in content or []:
+                        if not item:
+                            continue
+                        if _process_train_update(item.get("content"), train_number, sm, scheduled_ms):
+                            last_train_msg = time.time()
+
+                elif source.startswith("trajectory"):
+                    # Individual trajectory update
+                    if _process_train_update(content, train_number, sm, scheduled_ms):
                         last_train_msg = time.time()
-                    _process_train_update(trajectory, train_number, sm, scheduled_ms)
-
-            elif source.startswith("trajectory"):
-                # Individual trajectory update
-                if _is_our_train(content, train_number):
-                    last_train_msg = time.time()
-                _process_train_update(content, train_number, sm, scheduled_ms)
 
         except json.JSONDecodeError:
             pass
         except Exception as e:
             print(f"❌ Error processing update: {e}")
-            traceback.print_exc()
+            # Format the full traceback only the first time an error shows up;
+            # a repeating bad frame shouldn't stall the loop on every message
+            key = (type(e), str(e))
+            if key not in traced_errors:
+                traced_errors.add(key)
+                traceback.print_exc()
 
         if sm.state != State.WAITING_AT_NONAME:
             departed = True
@@ -232,26 +283,22 @@ async def track_with_state_machine(ws, train_number: int, sm: TrainStateMachine,
     return False
 
 
-def _is_our_train(data: dict, train_number: int) -> bool:
-    """Return True if this trajectory update belongs to the tracked train."""
-    if not isinstance(data, dict):
-        return False
-    return data.get("properties", {}).get("train_number") == train_number
-
-
 def _process_train_update(
     data: dict, train_number: int, sm: TrainStateMachine,
     scheduled_ms: float
-) -> None:
+) -> bool:
     """
     Process a single train update. Feed state changes to the state machine.
+
+    Returns True if the update belongs to the tracked train.
     """
+    # Reject other trains with as few lookups as possible (no {} default
+    # allocated per miss) — this runs for every trajectory in a buffer
     if not isinstance(data, dict):
-        return
-
-    props = data.get("properties", {})
-    if props.get("train_number") != train_number:
-        return
+        return False
+    props = data.get("properties")
+    if props is None or props.get("train_number") != train_number:
+        return False
 
     new_state = props.get("state")
     raw_coords = props.get("raw_coordinates")
@@ -263,7 +310,7 @@ def _process_train_update(
 
     # Only feed state machine on actual state CHANGES (sm.last_api_state tracks current)
     if new_state and new_state != sm.last_api_state:
-        now = datetime.now().strftime("%H:%M:%S")
+        now = clock_str()
         delay = props.get("delay") or 0
         delay_str = f" (delay: {delay/1000:.0f}s)" if delay else " (on time)"
         pos_str = f"\n   🗺️  https://www.google.com/maps?q={coordinates[1]},{coordinates[0]}" if coordinates else ""
@@ -275,6 +322,8 @@ def _process_train_update(
 
         sm.on_api_state_change(new_state, coordinates, arrival_unix)
 
+    return True
+
 
 # ── Stdin listener for simulated HALL events ────────────────────────────
 
@@ -291,7 +340,7 @@ async def stdin_listener(sm: TrainStateMachine):
         cmd = line.decode().strip().lower()
 
         if cmd == "h":
-            now = datetime.now().strftime("%H:%M:%S")
+            now = clock_str()
             print(f"\n[{now}] 🧲 HALL sensor triggered!")
             sm.on_hall_sensor()
         elif cmd == "s":
@@ -395,7 +444,7 @@ async def main():
 
                             print(f"\n📋 Timetable ({len(trains)} trains):")
                             for t in trains:
-                                marker = "→" if any(d in t["destination"] for d in TARGET_DESTINATIONS) else " "
+                                marker = "→" if TARGET_RE.search(t["destination"]) else " "
                                 skip = " (already passed, skipping)" if t["timestamp"] <= last_scheduled_ms else ""
                                 print(f"   {marker} {t['number']} → {t['destination']} @ {t['time']}{skip}")
 
@@ -452,7 +501,7 @@ async def main():
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        run_event_loop(main())
     except KeyboardInterrupt:
         print("\n👋 Bye!")
         sys.exit(0)
@@ -11,6 +11,7 @@ Protocol:
 """
 
 import asyncio
+import socket
 from outputs import ModelOutput
 
 # ============================================================
@@ -22,6 +23,12 @@ MODEL_TCP_PORT = 8080
 # MCU sends PING every 3s, expects PONG within 10s
 # Server should timeout if no PING received for 15s
 PING_TIMEOUT = 15  # seconds - if no PING received from MCU, close connection
+
+# Kernel TCP keepalive on the accepted socket (catches dead peers even if the
+# MCU stops sending PINGs mid-write). Linux option names; skipped elsewhere.
+KEEPALIVE_IDLE = 5      # seconds idle before the first probe
+KEEPALIVE_INTERVAL = 2  # seconds between probes
+KEEPALIVE_COUNT = 3     # failed probes before the connection is dropped
 # ============================================================
 
 
@@ -69,6 +76,16 @@ class TcpModelOutput(ModelOutput):
         self._do_send(f"BRAKE_DEAD_ZONE:{value}\n")
 
 
+def enable_keepalive(sock: socket.socket):
+    """Turn on TCP keepalive with short timers where the platform supports them."""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for name, value in (("TCP_KEEPIDLE", KEEPALIVE_IDLE),
+                        ("TCP_KEEPINTVL", KEEPALIVE_INTERVAL),
+                        ("TCP_KEEPCNT", KEEPALIVE_COUNT)):
+        if hasattr(socket, name):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+
+
 async def tcp_model_server(model_output: TcpModelOutput, state_machine):
     """
     TCP server that accepts ONE model train connection at a time.
@@ -78,6 +95,10 @@ async def tcp_model_server(model_output: TcpModelOutput, state_machine):
     async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
         peer = writer.get_extra_info("peername")
         print(f"📡 TCP connection from {peer}")
+
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            enable_keepalive(sock)
         
         last_ping_received = asyncio.get_running_loop().time()
 